@@ -1,9 +1,25 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import datetime
+import importlib.util
 import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+DB_FILE = "inventory.db"
+# Legacy workbook, imported once on first run and never written by the app
 EXCEL_FILE = "inventory_system.xlsx"
+EXPORT_FILE = "inventory_export.xlsx"
+# Stored in PRAGMA user_version once the tables exist and EXCEL_FILE is imported
+SCHEMA_VERSION = 1
+# xlsxwriter streams the workbook out and is much faster than openpyxl
+EXCEL_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+# calamine (Rust) parses xlsx far faster than openpyxl, but pandas only supports it
+# from 2.2; None lets pandas pick its default
+PANDAS_VERSION = tuple(int(part) for part in pd.__version__.split(".")[:2])
+IMPORT_ENGINE = "calamine" if PANDAS_VERSION >= (2, 2) and importlib.util.find_spec("python_calamine") else None
 
 required_sheets = {
     "Stock": ["ItemCode", "Item", "Stock", "Price1", "Price2", "Price3"],
@@ -15,16 +31,13 @@ required_sheets = {
     "OwingPurchases": ["Date", "InvoiceID", "Amount", "DueDate", "Paid"]
 }
 
-if not os.path.exists(EXCEL_FILE):
-    with pd.ExcelWriter(EXCEL_FILE) as writer:
-        for sheet, cols in required_sheets.items():
-            pd.DataFrame(columns=cols).to_excel(writer, sheet_name=sheet, index=False)
-else:
-    existing_sheets = pd.ExcelFile(EXCEL_FILE).sheet_names
-    with pd.ExcelWriter(EXCEL_FILE, mode="a", engine="openpyxl", if_sheet_exists="overlay") as writer:
-        for sheet, cols in required_sheets.items():
-            if sheet not in existing_sheets:
-                pd.DataFrame(columns=cols).to_excel(writer, sheet_name=sheet, index=False)
+# Low-cardinality keys repeated across sheets; stored as categoricals after load
+CATEGORY_COLUMNS = ["ItemCode", "InvoiceType", "Type"]
+# Parsed to datetime64 once on load instead of at every use
+DATE_COLUMNS = ["Date", "FutureDate", "DueDate"]
+# "mixed" (pandas >= 2.0) parses each value on its own; older pandas does that without a format
+# and turns every value into NaT if given "mixed"
+DATE_FORMAT = "mixed" if PANDAS_VERSION >= (2, 0) else None
 
 def ensure_columns(df, required_cols):
     """Make sure DataFrame has all required columns, adding any missing as empty."""
@@ -36,43 +49,200 @@ def ensure_columns(df, required_cols):
                 df[col] = pd.NA
     return df
 
-def load_sheet(sheet):
+def to_db_value(value):
+    """Convert pandas/numpy scalars and dates into values sqlite3 can bind."""
+    if pd.isna(value):
+        return None
+    # Imported workbook dates arrive as midnight Timestamps; store them like the form dates
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        value = value.date()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def insert_sql(sheet):
+    cols = ", ".join(f'"{col}"' for col in required_sheets[sheet])
+    marks = ", ".join("?" for _ in required_sheets[sheet])
+    return f'INSERT INTO "{sheet}" ({cols}) VALUES ({marks})'
+
+def init_db(conn):
+    """Create the tables and import EXCEL_FILE in one transaction that also sets user_version.
+
+    A failed import rolls back entirely and is retried on the next run.
+    """
+    with conn:
+        conn.execute("BEGIN")
+        for sheet, cols in required_sheets.items():
+            col_defs = ", ".join(f'"{col}"' for col in cols)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{sheet}" ({col_defs})')
+        if os.path.exists(EXCEL_FILE):
+            # One-time import of the workbook used before the SQLite store
+            with pd.ExcelFile(EXCEL_FILE, engine=IMPORT_ENGINE) as xl:
+                all_sheets = pd.read_excel(xl, sheet_name=[sheet for sheet in required_sheets if sheet in xl.sheet_names])
+            for sheet, df in all_sheets.items():
+                cols = required_sheets[sheet]
+                rows = ensure_columns(df, cols)[cols].itertuples(index=False)
+                conn.executemany(insert_sql(sheet), [[to_db_value(v) for v in row] for row in rows])
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+@st.cache_resource(show_spinner=False)
+def get_connection():
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False)
     try:
-        df = pd.read_excel(EXCEL_FILE, sheet_name=sheet)
-        df = ensure_columns(df, required_sheets[sheet])
-        return df
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            init_db(conn)
+    except Exception:
+        conn.close()
+        raise
+    return conn
+
+@st.cache_resource(show_spinner=False)
+def get_db_lock():
+    """Serializes use of the shared connection across sessions' script threads."""
+    return threading.Lock()
+
+conn = get_connection()
+db_lock = get_db_lock()
+
+def db_version():
+    """(mtime_ns, size) of the database file; changes whenever a write is committed."""
+    stat = os.stat(DB_FILE)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def read_table(sheet):
+    """Rows of `sheet` exactly as stored, indexed by rowid."""
+    with db_lock:
+        return pd.read_sql(f'SELECT rowid, * FROM "{sheet}"', conn, index_col="rowid")
+
+def normalize_types(df, sheet):
+    """Add missing columns and convert to the dtypes the app works with."""
+    df = ensure_columns(df, required_sheets[sheet])
+    for col in ["Paid", "Claimed"]:
+        if col in df.columns:
+            df[col] = df[col].fillna(0).astype(bool)
+    for col in DATE_COLUMNS:
+        if col in df.columns:
+            # Handles ISO dates written by the app as well as legacy text like "04/06/2025"
+            df[col] = pd.to_datetime(df[col], format=DATE_FORMAT, errors="coerce")
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+# One live version per table plus headroom; superseded versions get evicted
+@st.cache_data(show_spinner=False, max_entries=2 * len(required_sheets))
+def load_sheet(sheet, version):
+    """Read a table; `version` comes from db_version() so any write invalidates the cache."""
+    try:
+        df = read_table(sheet)
     except Exception as e:
         st.error(f"Error loading sheet '{sheet}': {e}")
-        return pd.DataFrame(columns=required_sheets[sheet])
+        df = pd.DataFrame(columns=required_sheets[sheet])
+    return normalize_types(df, sheet)
+
+# The write helpers below don't commit; each callback wraps its writes in
+# `with db_lock, conn:` so they land in a single transaction that no other
+# session's statements can join.
+def insert_rows(sheet, rows):
+    """Append `rows` (lists in required_sheets column order) with one executemany."""
+    conn.executemany(insert_sql(sheet), [[to_db_value(v) for v in row] for row in rows])
+
+def update_rows(sheet, col, values):
+    """Write `values` (a Series indexed by rowid) into `col` of the matching rows."""
+    conn.executemany(
+        f'UPDATE "{sheet}" SET "{col}" = ? WHERE rowid = ?',
+        [(to_db_value(v), int(rowid)) for rowid, v in values.items()]
+    )
+
+def adjust_stock(item_code, delta):
+    conn.execute(
+        'UPDATE "Stock" SET "Stock" = COALESCE("Stock", 0) + ? WHERE "ItemCode" = ?',
+        (to_db_value(delta), to_db_value(item_code))
+    )
+
+@st.cache_resource
+def get_export_pool():
+    """One worker shared by all sessions, so workbook writes never overlap."""
+    return ThreadPoolExecutor(max_workers=1)
+
+def write_excel(frames):
+    with pd.ExcelWriter(EXPORT_FILE, engine=EXCEL_ENGINE) as writer:
+        for sheet, df in frames.items():
+            df.to_excel(writer, sheet_name=sheet, index=False)
+
+def export_frame(sheet):
+    """`sheet` with real dates and booleans; dates that don't parse keep their stored text."""
+    raw = read_table(sheet)
+    df = normalize_types(raw.copy(), sheet)
+    for col in DATE_COLUMNS:
+        if col in raw.columns:
+            df[col] = df[col].astype(object).where(df[col].notna(), raw[col])
+    return df
 
-def save_sheet(df, sheet):
-    with pd.ExcelWriter(EXCEL_FILE, mode="a", engine="openpyxl", if_sheet_exists="replace") as writer:
-        df.to_excel(writer, sheet_name=sheet, index=False)
+def export_excel():
+    """Queue a write of every table to EXPORT_FILE; returns the Future."""
+    frames = {sheet: export_frame(sheet) for sheet in required_sheets}
+    return get_export_pool().submit(write_excel, frames)
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def item_lookups(version):
+    """ItemCode selectbox options and the ItemCode -> Item lookup for one database version."""
+    stock = load_sheet("Stock", version).drop_duplicates("ItemCode")
+    return stock["ItemCode"].tolist(), dict(zip(stock["ItemCode"], stock["Item"]))
+
+def poll_export():
+    """Run as a fragment while an export is pending; reruns the app once it finishes."""
+    export = st.session_state["export"]
+    if export.done():
+        del st.session_state["export"]
+        st.session_state["export_error"] = export.exception()
+        st.rerun()
+
+def notify(message):
+    """Rerun so every tab picks up the new data, then show `message`."""
+    st.session_state["flash"] = message
+    st.rerun()
 
 st.set_page_config(layout="wide")
 st.title("Inventory Management System")
 
-cheques_df = load_sheet("Cheques")
-owing_df = load_sheet("OwingPurchases")
-stock_df = load_sheet("Stock")
-sales_df = load_sheet("Sales")
-update_df = load_sheet("StockUpdate")
-expenses_df = load_sheet("Expenses")
-bill_df = load_sheet("BillToBill")
+if "flash" in st.session_state:
+    st.success(st.session_state.pop("flash"))
+
+if "export_error" in st.session_state:
+    export_error = st.session_state.pop("export_error")
+    if export_error is not None:
+        st.sidebar.error(f"Export failed: {export_error}")
+    else:
+        st.toast(f"Exported to {EXPORT_FILE}.")
+
+if st.sidebar.button("Export to Excel"):
+    st.session_state["export"] = export_excel()
+    st.sidebar.info("Export started.")
+
+# Poll only while an export is pending, so the result shows without further interaction
+if "export" in st.session_state:
+    st.fragment(run_every=1)(poll_export)()
+
+# Only the sheets needed above the tabs or by several tabs are loaded here;
+# the rest are loaded inside the tab that shows them.
+version = db_version()
+cheques_df = load_sheet("Cheques", version)
+owing_df = load_sheet("OwingPurchases", version)
+# Indexed by ItemCode so per-item lookups are hash probes rather than column scans
+stock_df = load_sheet("Stock", version).set_index("ItemCode")
+codes, name_map = item_lookups(version)
 
 # Calculate reminders
 today = datetime.date.today()
 
 def due_soon_alert(df, date_col, bool_col):
     # Check if any rows have unpaid/unclaimed and due date within 3 days
-    df = df.copy()
-    df[date_col] = pd.to_datetime(df[date_col], errors='coerce').dt.date
-    for idx, row in df.iterrows():
-        if not row[bool_col] and row[date_col] is not pd.NaT:
-            days_left = (row[date_col] - today).days
-            if days_left <= 3 and days_left >= 0:
-                return True
-    return False
+    due = df[date_col].dt.normalize()
+    days_left = (due - pd.Timestamp(today)).dt.days
+    return bool((~df[bool_col] & days_left.between(0, 3)).any())
 
 cheques_due_soon = due_soon_alert(cheques_df, "FutureDate", "Claimed")
 owing_due_soon = due_soon_alert(owing_df, "DueDate", "Paid")
@@ -93,17 +263,18 @@ tabs = st.tabs([
 # Current Stock tab
 with tabs[0]:
     st.subheader("Stock Overview")
-    def highlight_low_stock(val):
-        return ["background-color: red" if v < 10 else "" for v in val] if val.name == "Stock" else ["" for _ in val]
+    def highlight_low_stock(stock):
+        return np.where(stock < 10, "background-color: red", "")
 
-    st.dataframe(stock_df.style.apply(highlight_low_stock, axis=0), use_container_width=True)
+    # Styler rejects a non-unique index, and ItemCode can repeat in the hand-edited sheet
+    st.dataframe(stock_df.reset_index().style.apply(highlight_low_stock, subset=["Stock"]), use_container_width=True)
 
 # Sales & Stock Update tab
 with tabs[1]:
     st.subheader("Add Sale")
     with st.form("sale_form"):
         date = st.date_input("Date", value=today)
-        item_code = st.selectbox("Item Code", stock_df["ItemCode"].unique())
+        item_code = st.selectbox("Item Code", codes)
         qty = st.number_input("Quantity", min_value=1)
         price_col = st.selectbox("Selling Price Column", ["Price1", "Price2", "Price3"])
         invoice_type = st.selectbox("Invoice Type", ["Cash", "Credit"])
@@ -111,31 +282,28 @@ with tabs[1]:
         submitted = st.form_submit_button("Record Sale")
 
         if submitted:
-            item_row = stock_df[stock_df["ItemCode"] == item_code].iloc[0]
-            selling_price = item_row[price_col]
+            # First match, as the Stock table has no uniqueness constraint on ItemCode
+            selling_price = stock_df.loc[[item_code], price_col].iloc[0]
             total = qty * selling_price
-            sales_df.loc[len(sales_df)] = [date, item_code, qty, selling_price, total, invoice_type, invoice_id]
-            update_df.loc[len(update_df)] = [date, item_code, -qty, "Sale", pd.NA]
-            stock_df.loc[stock_df["ItemCode"] == item_code, "Stock"] -= qty
-            save_sheet(sales_df, "Sales")
-            save_sheet(update_df, "StockUpdate")
-            save_sheet(stock_df, "Stock")
-            st.success("Sale recorded.")
+            with db_lock, conn:
+                insert_rows("Sales", [[date, item_code, qty, selling_price, total, invoice_type, invoice_id]])
+                insert_rows("StockUpdate", [[date, item_code, -qty, "Sale", pd.NA]])
+                adjust_stock(item_code, -qty)
+            notify("Sale recorded.")
 
     st.subheader("Update Stock")
     with st.form("stock_update_form"):
         date = st.date_input("Date", value=today, key="stock")
-        item_code = st.selectbox("Item Code", stock_df["ItemCode"].unique(), key="stock_item")
+        item_code = st.selectbox("Item Code", codes, key="stock_item")
         qty = st.number_input("Quantity", min_value=1, key="stock_qty")
         bought_price = st.number_input("Bought Price", min_value=0.0, step=0.01)
         submitted = st.form_submit_button("Update Stock")
 
         if submitted:
-            update_df.loc[len(update_df)] = [date, item_code, qty, "Restock", bought_price]
-            stock_df.loc[stock_df["ItemCode"] == item_code, "Stock"] += qty
-            save_sheet(update_df, "StockUpdate")
-            save_sheet(stock_df, "Stock")
-            st.success("Stock updated.")
+            with db_lock, conn:
+                insert_rows("StockUpdate", [[date, item_code, qty, "Restock", bought_price]])
+                adjust_stock(item_code, qty)
+            notify("Stock updated.")
 
 # Cheques tab
 with tabs[2]:
@@ -144,25 +312,33 @@ with tabs[2]:
         with st.form("add_cheque"):
             date = st.date_input("Date", value=today, key="chq_date")
             future_date = st.date_input("Future Date", key="future_date")
-            item_code = st.selectbox("Item Code", stock_df["ItemCode"].unique(), key="chq_item")
+            item_code = st.selectbox("Item Code", codes, key="chq_item")
             qty = st.number_input("Quantity", min_value=1, key="chq_qty")
             amount = st.number_input("Amount", min_value=0.0, step=0.01)
             submitted = st.form_submit_button("Add Cheque")
             if submitted:
-                cheques_df.loc[len(cheques_df)] = [date, future_date, item_code, qty, amount, False]
-                save_sheet(cheques_df, "Cheques")
-                st.success("Cheque added.")
+                with db_lock, conn:
+                    insert_rows("Cheques", [[date, future_date, item_code, qty, amount, False]])
+                notify("Cheque added.")
 
     st.subheader("Update Claimed Status")
-    for i, row in cheques_df.iterrows():
-        checked = st.checkbox(f"Claimed: {row['ItemCode']} on {row['FutureDate']}", value=row["Claimed"], key=f"chq_{i}")
-        cheques_df.at[i, "Claimed"] = checked
+    cheques_view = cheques_df.assign(Item=cheques_df["ItemCode"].map(name_map))
+    edited_cheques = st.data_editor(
+        cheques_view,
+        column_config={"Claimed": st.column_config.CheckboxColumn()},
+        disabled=[col for col in cheques_view.columns if col != "Claimed"],
+        num_rows="fixed",
+        key="cheq"
+    )
 
     if st.button("Save Cheque Updates"):
-        save_sheet(cheques_df, "Cheques")
-        st.success("Cheque updates saved.")
-
-    st.dataframe(cheques_df)
+        changed = edited_cheques["Claimed"] != cheques_df["Claimed"]
+        if changed.any():
+            with db_lock, conn:
+                update_rows("Cheques", "Claimed", edited_cheques.loc[changed, "Claimed"])
+        # Drop the editor's pending edits so they aren't replayed onto reloaded rows
+        st.session_state.pop("cheq", None)
+        notify("Cheque updates saved.")
 
 # Monthly Payments tab
 with tabs[3]:
@@ -174,47 +350,58 @@ with tabs[3]:
             amount = st.number_input("Amount", min_value=0.0, step=0.01)
             submitted = st.form_submit_button("Add Expense")
             if submitted:
-                expenses_df.loc[len(expenses_df)] = [month.strftime("%Y-%m"), expense_type, amount]
-                save_sheet(expenses_df, "Expenses")
-                st.success("Expense added.")
+                with db_lock, conn:
+                    insert_rows("Expenses", [[month.strftime("%Y-%m"), expense_type, amount]])
+                notify("Expense added.")
+    expenses_df = load_sheet("Expenses", version)
     st.dataframe(expenses_df)
 
 # Bill-to-Bill tab
 with tabs[4]:
     st.subheader("Bill-to-Bill Invoices")
-    st.dataframe(bill_df[["Date", "InvoiceID", "Amount", "DueDate", "Paid"]])
+    bill_df = load_sheet("BillToBill", version)
+    late = bill_df["DueDate"] < pd.Timestamp(today)
+    status = np.where(bill_df["Paid"], "✅ Paid", np.where(late, "🔴 Late", "🟡 Pending"))
+    st.dataframe(bill_df[["Date", "InvoiceID", "Amount", "DueDate", "Paid"]].assign(Status=status))
 
 # Owing Purchases tab
 with tabs[5]:
     st.subheader("Owing Purchases")
     st.subheader("Update Paid Status")
-    for i, row in owing_df.iterrows():
-        checked = st.checkbox(f"Paid: {row['InvoiceID']} due {row['DueDate']}", value=row["Paid"], key=f"own_{i}")
-        owing_df.at[i, "Paid"] = checked
+    owing_view = owing_df[["Date", "InvoiceID", "Amount", "DueDate", "Paid"]]
+    edited_owing = st.data_editor(
+        owing_view,
+        column_config={"Paid": st.column_config.CheckboxColumn()},
+        disabled=[col for col in owing_view.columns if col != "Paid"],
+        num_rows="fixed",
+        key="owing"
+    )
 
     if st.button("Save Owing Updates"):
-        save_sheet(owing_df, "OwingPurchases")
-        st.success("Owing purchase updates saved.")
-
-    st.dataframe(owing_df[["Date", "InvoiceID", "Amount", "DueDate", "Paid"]])
+        changed = edited_owing["Paid"] != owing_df["Paid"]
+        if changed.any():
+            with db_lock, conn:
+                update_rows("OwingPurchases", "Paid", edited_owing.loc[changed, "Paid"])
+        st.session_state.pop("owing", None)
+        notify("Owing purchase updates saved.")
 
 # Dashboard tab
 with tabs[6]:
     st.subheader("Summary Dashboard")
+    sales_df = load_sheet("Sales", version)
+    update_df = load_sheet("StockUpdate", version)
+    expenses_df = load_sheet("Expenses", version)
+
     total_sales = sales_df["Total"].sum()
     total_expense = expenses_df["Amount"].sum()
 
     selected_price_col = st.selectbox("Select Price Column for Stock Value", ["Price1", "Price2", "Price3"], index=0)
     total_stock_value = (stock_df["Stock"] * stock_df[selected_price_col]).sum()
 
-    profit = 0
     try:
-        for idx, sale in sales_df.iterrows():
-            item_code = sale["ItemCode"]
-            qty_sold = sale["Qty"]
-            bought_prices = update_df[(update_df["ItemCode"] == item_code) & (update_df["BoughtPrice"].notnull())]["BoughtPrice"]
-            cost_price = bought_prices.mean() if not bought_prices.empty else 0
-            profit += qty_sold * (sale["Price"] - cost_price)
+        avg_cost = update_df.dropna(subset=["BoughtPrice"]).groupby("ItemCode", observed=True)["BoughtPrice"].mean()
+        cost_price = sales_df["ItemCode"].map(avg_cost).astype(float).fillna(0)
+        profit = ((sales_df["Price"] - cost_price) * sales_df["Qty"]).sum()
     except Exception:
         profit = total_sales - total_expense
 
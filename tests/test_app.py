@@ -0,0 +1,25 @@
+import os
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+def test_duplicate_item_codes_render_every_tab(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    stock = pd.DataFrame({
+        "ItemCode": ["A1", "A1", "B2"],
+        "Item": ["Bolt", "Bolt", "Nut"],
+        "Stock": [5, 20, 3],
+        "Price1": [10.0, 10.0, 2.0],
+        "Price2": [11.0, 11.0, 2.5],
+        "Price3": [12.0, 12.0, 3.0],
+    })
+    with pd.ExcelWriter("inventory_system.xlsx") as writer:
+        stock.to_excel(writer, sheet_name="Stock", index=False)
+
+    at = AppTest.from_file(APP).run()
+
+    assert not at.exception
+    assert at.metric[0].label == "Total Sales"